@@ -5,7 +5,17 @@ import logging
 import os
 import sys
 
-from tools import libvmdk, libvslvm, lklfuse, nbdfuse, subfiles, unmount, rmdir
+from concurrent.futures import ThreadPoolExecutor
+from tools import (
+    libvmdk,
+    libvslvm,
+    lklfuse,
+    mount_many,
+    mountpoints,
+    nbdfuse,
+    subfile_entries,
+    unmount
+)
 from tools.inspect_apps import (
     list_applications_apk,
     list_applications_dpkg,
@@ -15,7 +25,16 @@ from tools.inspect_apps import (
     list_applications_windows
 )
 from tools.inspect_os import get_linux_os_info, get_windows_os_info
-from tools.pyparted import list_partitions
+from tools.pyparted import iter_partitions, list_partitions
+
+LIST_APPLICATIONS = {
+    "apk": list_applications_apk,
+    "dpkg": list_applications_dpkg,
+    "pacman": list_applications_pacman,
+    "portage": list_applications_portage,
+    "rpm": list_applications_rpm,
+    "win": list_applications_windows
+}
 
 parser = argparse.ArgumentParser()
 parser.description = "Tool for inspecting a disk image file to determine "\
@@ -53,66 +72,67 @@ else:
 parts = list_partitions(raw)
 if not parts:
     unmount(image_mp)
-    rmdir(image_mp)
+    mountpoints.release(image_mp)
     print("could not find any partitions", file=sys.stderr)
     sys.exit(1)
 
 fs_mps = []
 lvm = [part for part in parts if part["type"] == "lvm"]
 lvm_mp = None
+for part in lvm:
+    # Use the first LVM volume system that can be mounted.
+    if lvm_mp := libvslvm.mount(raw, part["offset"]):
+        break
 
+# Arguments of lklfuse.mount for all filesystems, which are then mounted
+# concurrently.
+specs = []
 if not lvm:
-    for part in parts:
-        if fs_mp := lklfuse.mount(raw, part["type"], part["nr"]):
-            fs_mps.append((fs_mp, part["type"]))
-elif lvm_mp := libvslvm.mount(raw, lvm[0]["offset"]):
-    for vol in subfiles(lvm_mp):
-        vol_path = os.path.join(lvm_mp, vol)
-        vol_part = list_partitions(vol_path)
-        if not vol_part:
-            continue
-        if fs_mp := lklfuse.mount(vol_path, vol_part[0]["type"]):
-            fs_mps.append((fs_mp, vol_part[0]["type"]))
-
+    specs = [(raw, part["type"], part["nr"]) for part in parts]
+elif lvm_mp:
+    for vol in subfile_entries(lvm_mp):
+        # A logical volume only holds a single filesystem.
+        if vol_part := next(iter_partitions(vol.path), None):
+            specs.append((vol.path, vol_part["type"]))
+for spec, fs_mp in zip(specs, mount_many(lklfuse.mount, specs)):
+    if fs_mp:
+        fs_mps.append((fs_mp, spec[1]))
+
+# Detecting the operating system is I/O-bound as well, e.g. parsing the
+# SOFTWARE hive, so all filesystems are checked concurrently. The first result
+# in partition order wins.
 os_info = {}
-for k, v in fs_mps:
-    if v == "ntfs":
-        os_info = get_windows_os_info(k)
-    else:
-        os_info = get_linux_os_info(k)
-    if os_info:
-        break
+root_fs = None
+if fs_mps:
+    with ThreadPoolExecutor(max_workers=min(8, len(fs_mps))) as ex:
+        futures = [
+            ex.submit(get_windows_os_info, k) if v == "ntfs"
+            else ex.submit(get_linux_os_info, k)
+            for k, v in fs_mps
+        ]
+    for (k, _), future in zip(fs_mps, futures):
+        if os_info := future.result():
+            root_fs = k
+            break
 
 apps = []
 package_manager = os_info.get("package_manager", "")
-for k, _ in fs_mps:
-    if package_manager == "apk":
-        apps = list_applications_apk(k)
-    elif package_manager == "dpkg":
-        apps = list_applications_dpkg(k)
-    elif package_manager == "pacman":
-        apps = list_applications_pacman(k)
-    elif package_manager == "portage":
-        apps = list_applications_portage(k)
-    elif package_manager == "rpm":
-        apps = list_applications_rpm(k)
-    elif package_manager == "win":
-        apps = list_applications_windows(k)
-    else:
-        break
-    if apps:
-        break
-
-for k, _ in fs_mps:
-    unmount(k)
-    rmdir(k)
-
-if lvm_mp:
-    unmount(lvm_mp)
-    rmdir(lvm_mp)
-
-unmount(image_mp)
-rmdir(image_mp)
+if list_applications := LIST_APPLICATIONS.get(package_manager):
+    # The package database is usually found on the filesystem the operating
+    # system was detected on. Only fall back to the others, e.g. a separate
+    # /var partition, if it is not there.
+    for k in sorted((k for k, _ in fs_mps), key=lambda k: k != root_fs):
+        if apps := list_applications(k):
+            break
+
+# Tear down from the inside out: the filesystems, which are unmounted
+# concurrently, then the LVM volume system and finally the disk image.
+for mps in ([k for k, _ in fs_mps], [lvm_mp], [image_mp]):
+    if mps := [mp for mp in mps if mp]:
+        with ThreadPoolExecutor(max_workers=min(8, len(mps))) as ex:
+            ex.map(unmount, mps)
+        for mp in mps:
+            mountpoints.release(mp)
 
 print({
     "name": os_info.get("name", ""),
@@ -1,30 +1,74 @@
+import atexit
 import logging
 import os
+import select
+import shutil
+import threading
 
-from functools import wraps
-from subprocess import run
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+from subprocess import DEVNULL, run
+from time import monotonic, sleep
+from . import mountpoints
 
 __all__ = [
+    "mount_many",
     "unmount",
     "rmdir",
     "subdirs",
-    "subfiles"
+    "subdir_entries",
+    "subfiles",
+    "subfile_entries"
 ]
 
 L = logging.getLogger(__name__)
 
+_which = lru_cache(maxsize=None)(shutil.which)
+
+# Seconds to wait for a FUSE filesystem to be mounted.
+MOUNT_TIMEOUT = 30
+
+# Minimal environment of the spawned FUSE helpers. The C locale keeps their
+# messages untranslated for the log.
+SPAWN_ENV = {
+    k: v for k, v in os.environ.items() if k in ("PATH", "HOME", "TMPDIR")
+}
+SPAWN_ENV["LANG"] = "C"
+
+# Mounts shared by the shared decorator. _shared_mounts maps the key of a
+# mounted file to its mount point and reference count, _shared_keys maps the
+# mount point back to that key.
+_shared_lock = threading.Lock()
+_shared_mounts = {}
+_shared_keys = {}
+_shared_atexit = False
+
 
 def log(func):
     """Simple decorator for logging function calls."""
+    # Name the file of the innermost function, e.g. not that of memoize.
+    code = func
+    while hasattr(code, "__wrapped__"):
+        code = code.__wrapped__
+    file_name = os.path.basename(code.__code__.co_filename)
+    file_name = os.path.splitext(file_name)[0]
+    func_name = func.__name__ if file_name == "__init__" \
+        else f"{file_name}.{func.__name__}"
+
     @wraps(func)
     def _log(*args, **kwargs):
+        # Skip building the representation of the arguments and the result
+        # unless they are actually logged.
+        if not L.isEnabledFor(logging.DEBUG):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                L.error("%s raised %r", func_name, e)
+                raise e
         args_repr = [repr(a) for a in args]
         kwargs_repr = [f"{k}={v!r}" for k, v in kwargs.items()]
         params = ", ".join(args_repr + kwargs_repr)
-        file_name = os.path.basename(func.__code__.co_filename)
-        file_name = os.path.splitext(file_name)[0]
-        func_name = func.__name__ if file_name == "__init__" \
-            else f"{file_name}.{func.__name__}"
         L.debug("%s called with %s", func_name, params)
         try:
             result = func(*args, **kwargs)
@@ -36,10 +80,87 @@ def log(func):
     return _log
 
 
+def shared(func):
+    """Decorator for sharing the mount of a file between its callers.
+
+    The decorated function must take the path to the mounted file as its
+    first argument and return the mount point, or a falsy value on failure.
+    Calls with the same file, identified by its real path and inode, and the
+    same remaining arguments return the existing mount point instead of
+    spawning another FUSE process. Each call must be paired with a call of
+    unmount, which only unmounts the filesystem once the last caller is done.
+    Mounts that are still in use when the process exits are unmounted then.
+    """
+    @wraps(func)
+    def _shared(path, *args, **kwargs):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return func(path, *args, **kwargs)
+
+        key = (
+            func.__module__,
+            func.__qualname__,
+            os.path.realpath(path),
+            st.st_dev,
+            st.st_ino,
+            args,
+            tuple(sorted(kwargs.items()))
+        )
+        with _shared_lock:
+            if entry := _shared_mounts.get(key):
+                entry[1] += 1
+                return entry[0]
+
+        if not (mp := func(path, *args, **kwargs)):
+            return mp
+
+        with _shared_lock:
+            if entry := _shared_mounts.get(key):
+                # Another thread has mounted the same file meanwhile.
+                entry[1] += 1
+                duplicate, mp = mp, entry[0]
+            else:
+                _shared_mounts[key] = [mp, 1]
+                _shared_keys[mp] = key
+                _register_atexit()
+                return mp
+
+        if _fusermount(duplicate):
+            mountpoints.release(duplicate)
+        return mp
+    return _shared
+
+
+def mount_many(mount, specs, max_workers=8):
+    """Call a mount function for several filesystems concurrently.
+
+    Mounting is mostly spent waiting for the FUSE helpers to come up. Thus,
+    all of them are started at once, so that mounting N filesystems takes
+    about as long as the slowest one instead of the sum of all of them.
+
+    Args:
+        mount (callable): Mount function, e.g. lklfuse.mount.
+        specs (list): Tuples of positional arguments, one per call.
+        max_workers (int): Maximum number of concurrent calls.
+
+    Returns:
+        List of the results, e.g. mount points, in the order of specs.
+    """
+    if len(specs) < 2:
+        return [mount(*spec) for spec in specs]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(specs))) as ex:
+        return list(ex.map(lambda spec: mount(*spec), specs))
+
+
 @log
 def unmount(path):
     """Unmount a FUSE filesystem using fusermount.
 
+    If the filesystem has been mounted by a function decorated with shared,
+    it is only unmounted once it is no longer in use by any other caller.
+
     See also:
     https://manpages.debian.org/bullseye/fuse/fusermount.1.en.html
 
@@ -49,9 +170,27 @@ def unmount(path):
     Returns:
         True if the command was successful, False otherwise.
     """
-    cmd = ["fusermount", "-u", path]
+    with _shared_lock:
+        if key := _shared_keys.get(path):
+            entry = _shared_mounts[key]
+            entry[1] -= 1
+            if entry[1] > 0:
+                L.debug("%s is still in use", path)
+                return True
+            del _shared_mounts[key]
+            del _shared_keys[path]
+
+    return _fusermount(path)
+
+
+def _fusermount(path):
+    """Run fusermount -u on a path regardless of whether it is shared."""
+    if not (fusermount := find_binary("fusermount")):
+        return False
+
+    cmd = [fusermount, "-u", path]
     try:
-        p = run(cmd, capture_output=True, check=False, text=True)
+        p = run(cmd, stdout=DEVNULL, stderr=DEVNULL, check=False)
     except Exception as e:
         L.error("failed to execute command %s: %r", cmd, e)
         return False
@@ -59,6 +198,104 @@ def unmount(path):
     return not p.returncode
 
 
+@log
+def wait_for_mount(path, proc, timeout=MOUNT_TIMEOUT):
+    """Wait until a FUSE filesystem is mounted or its process exits.
+
+    Instead of checking the mount point in fixed intervals, wait for changes
+    of the mount table by polling /proc/self/mountinfo, which the kernel
+    reports with POLLPRI. Hence, the mount is noticed as soon as it shows up.
+    The process is checked at least every 100 ms. A mount is detected by the
+    device of the mount point differing from that of its parent directory,
+    which is only looked up once, so each check takes a single stat call.
+    If /proc/self/mountinfo is not available, the mount point is checked with
+    an exponential backoff from 10 ms up to 100 ms instead. The process is
+    terminated if the filesystem is not mounted within the timeout.
+
+    See also:
+    https://man7.org/linux/man-pages/man5/proc.5.html (/proc/[pid]/mounts)
+
+    Args:
+        path (str): Path to the mount point.
+        proc (subprocess.Popen): Process serving the FUSE filesystem.
+        timeout (int|float): Maximum number of seconds to wait.
+
+    Returns:
+        True if the filesystem has been mounted, False if the process exited
+        or has been terminated.
+    """
+    parent_dev = os.stat(os.path.dirname(os.path.abspath(path))).st_dev
+
+    try:
+        mountinfo = open("/proc/self/mountinfo", "rb")
+    except OSError as e:
+        L.error("failed to open /proc/self/mountinfo: %r", e)
+        mountinfo = None
+
+    deadline = monotonic() + timeout
+    delay = 0.01
+    try:
+        if mountinfo:
+            poller = select.poll()
+            poller.register(mountinfo, select.POLLPRI)
+        while proc.poll() is None:
+            try:
+                if os.stat(path).st_dev != parent_dev:
+                    return True
+            except OSError as e:
+                L.debug("failed to stat %s: %r", path, e)
+            if monotonic() >= deadline:
+                L.error("%s has not been mounted within %ss", path, timeout)
+                proc.terminate()
+                proc.wait()
+                break
+            if mountinfo:
+                poller.poll(100)
+            else:
+                sleep(delay)
+                delay = min(delay * 1.5, 0.1)
+    finally:
+        if mountinfo:
+            mountinfo.close()
+
+    return False
+
+
+def find_binary(name):
+    """Find a binary, e.g. a FUSE helper, in the PATH.
+
+    Each binary is only looked up once. Thus, mount functions neither search
+    the PATH on every call nor spawn a binary that is missing, but fail right
+    away instead.
+
+    Args:
+        name (str): Name of the binary.
+
+    Returns:
+        Path to the binary or None if it was not found.
+    """
+    if not (path := _which(name)):
+        L.error("%s not found", name)
+    return path
+
+
+def log_failure(proc):
+    """Log the return code and stderr of a FUSE process that has exited
+    without mounting its filesystem.
+
+    Only the last 64 lines of stderr are kept and decoded, since these
+    usually contain the error.
+
+    Args:
+        proc (subprocess.Popen): Process started with stderr=PIPE.
+    """
+    with proc.stderr:
+        err = b"".join(deque(proc.stderr, maxlen=64))
+    err = err.decode("utf-8", "replace").strip()
+    L.error("%s failed with retcode %d, stderr: %s",
+            os.path.basename(proc.args[0]), proc.wait(), err)
+
+
 @log
 def rm(path):
     """Remove a file.
@@ -97,16 +334,60 @@ def rmdir(path):
     return True
 
 
+def _register_atexit():
+    """Register _unmount_shared on the first shared mount. Since exit
+    handlers run in reverse order, it then runs before the handler removing
+    the mount points, which has been registered when the first mount point
+    was acquired.
+    """
+    global _shared_atexit
+    if not _shared_atexit:
+        _shared_atexit = True
+        atexit.register(_unmount_shared)
+
+
+def _unmount_shared():
+    """Unmount the shared mounts still in use at exit.
+
+    Mounts are stacked, e.g. lklfuse serves a filesystem from the `nbd` file
+    of nbdfuse, so they are unmounted in reverse order of creation. Otherwise,
+    the outer mounts would still be busy.
+    """
+    with _shared_lock:
+        mps = list(_shared_keys)
+        _shared_mounts.clear()
+        _shared_keys.clear()
+
+    for mp in reversed(mps):
+        L.debug("unmounting leaked mount %s", mp)
+        if _fusermount(mp):
+            mountpoints.release(mp)
+
+
 def subdirs(path):
     """Yield directory names under given path using os.scandir.
 
     See also:
     https://docs.python.org/3/library/os.html#os.scandir
     """
+    for entry in subdir_entries(path):
+        yield entry.name
+
+
+def subdir_entries(path):
+    """Yield os.DirEntry objects of directories under given path using
+    os.scandir.
+
+    Unlike subdirs, the entries provide the full path and cached file type
+    information, so callers do not have to join and stat the path again.
+
+    See also:
+    https://docs.python.org/3/library/os.html#os.DirEntry
+    """
     with os.scandir(path) as it:
         for entry in it:
             if not entry.name.startswith(".") and entry.is_dir():
-                yield entry.name
+                yield entry
 
 
 def subfiles(path):
@@ -115,7 +396,17 @@ def subfiles(path):
     See also:
     https://docs.python.org/3/library/os.html#os.scandir
     """
+    for entry in subfile_entries(path):
+        yield entry.name
+
+
+def subfile_entries(path):
+    """Yield os.DirEntry objects of files under given path using os.scandir.
+
+    See also:
+    https://docs.python.org/3/library/os.html#os.DirEntry
+    """
     with os.scandir(path) as it:
         for entry in it:
             if not entry.name.startswith(".") and entry.is_file():
-                yield entry.name
+                yield entry
@@ -0,0 +1,132 @@
+import contextlib
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import tempfile
+
+from functools import wraps
+
+__all__ = ["memoize"]
+
+L = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "vm-inspector"
+)
+
+DISABLED = bool(os.environ.get("VM_INSPECTOR_DISABLE_CACHE"))
+
+# Part of every key. Bump it whenever a memoized parser or the format of its
+# result changes, so that results of older versions are not returned anymore.
+CACHE_VERSION = 1
+
+
+def memoize(func):
+    """Decorator for caching the results of a function parsing a file on disk.
+
+    The decorated function must take the path to the parsed file as its only
+    argument. Non-empty results are pickled to CACHE_DIR, keyed by
+    CACHE_VERSION and a digest of the content of that file, as well as of its
+    SQLite write-ahead log if any. Hashing a file is much cheaper than parsing
+    it. Thus, inspecting the same or an unchanged copy of an image again, e.g.
+    another snapshot of the same VM, skips parsing its package database or
+    registry hive. Set the environment variable VM_INSPECTOR_DISABLE_CACHE to
+    a non-empty value to disable the cache.
+    """
+    @wraps(func)
+    def _memoize(path):
+        if DISABLED:
+            return func(path)
+
+        try:
+            content = _digest(path)
+        except OSError as e:
+            L.error("failed to hash %s: %r", path, e)
+            return func(path)
+
+        # SQLite databases in WAL mode, e.g. rpmdb.sqlite, may only have
+        # changed in the -wal file, which leaves the main file untouched.
+        try:
+            wal = _digest(f"{path}-wal")
+        except OSError:
+            wal = None
+
+        key = repr((
+            CACHE_VERSION,
+            func.__module__,
+            func.__qualname__,
+            content,
+            wal
+        ))
+        digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        cache_file = os.path.join(CACHE_DIR, f"{digest}.pickle")
+
+        try:
+            with open(cache_file, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            L.error("failed to load cache file %s: %r", cache_file, e)
+
+        result = func(path)
+        if result:
+            _store(cache_file, result)
+
+        return result
+    return _memoize
+
+
+def _digest(path):
+    """Hash the content of a file.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        Hex digest of the file.
+
+    Raises:
+        OSError: If the file could not be read.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        # empty files can not be mapped
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
+    return h.hexdigest()
+
+
+def _store(cache_file, result):
+    """Pickle a result to a cache file atomically.
+
+    Args:
+        cache_file (str): Path to the cache file.
+        result (object): Result to store.
+
+    Returns:
+        True if the result was stored, False otherwise.
+    """
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR)
+    except OSError as e:
+        L.error("failed to create cache file in %s: %r", CACHE_DIR, e)
+        return False
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except Exception as e:
+        L.error("failed to store cache file %s: %r", cache_file, e)
+        # the cache directory may have been removed meanwhile
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        return False
+
+    return True
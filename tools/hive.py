@@ -0,0 +1,71 @@
+import logging
+import os
+
+from functools import lru_cache
+from . import log
+
+__all__ = ["find_software_hive", "open_hive"]
+
+L = logging.getLogger(__name__)
+
+
+@log
+def find_software_hive(path):
+    """Find the SOFTWARE registry hive of a windows distribution.
+
+    Args:
+        path (str): Path to the mounted filesystem.
+
+    Returns:
+        Path to the hive file or None if it was not found.
+    """
+    locations = [
+        "WINDOWS/system32/config/software",  # xp
+        "Windows/System32/config/SOFTWARE",  # others
+    ]
+
+    for location in locations:
+        software = os.path.join(path, location)
+        if os.path.isfile(software):
+            return software
+
+    return None
+
+
+def open_hive(path):
+    """Open a registry hive file using `python-registry`.
+
+    Parsing a hive is expensive, so the result is cached. This way e.g.
+    get_windows_os_info and list_applications_windows share a single parse of
+    the SOFTWARE hive. Since python-registry keeps the whole hive in memory,
+    only the last two hives are kept. They are keyed by the device, inode and
+    modification time of the file as well, so a reused mount point never
+    returns the hive of a previously inspected image. Call
+    open_hive.cache_clear() to drop the cached hives.
+
+    See also:
+    https://github.com/williballenthin/python-registry
+
+    Args:
+        path (str): Path to the hive file.
+
+    Returns:
+        Registry.Registry object.
+
+    Raises:
+        Exception: If the hive could not be opened or parsed.
+    """
+    st = os.stat(path)
+    return _open_hive(path, st.st_dev, st.st_ino, st.st_mtime_ns)
+
+
+@lru_cache(maxsize=2)
+def _open_hive(path, dev, ino, mtime_ns):
+    """Open a registry hive file. See open_hive."""
+    # python-registry is only imported when actually inspecting windows.
+    from Registry import Registry  # type: ignore
+
+    return Registry.Registry(path)
+
+
+open_hive.cache_clear = _open_hive.cache_clear
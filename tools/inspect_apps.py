@@ -1,10 +1,11 @@
 import logging
+import mmap
 import os
 import re
-import rpm  # type: ignore
 
-from Registry import Registry  # type: ignore
-from . import log, subdirs
+from . import log, subdir_entries
+from .cache import memoize
+from .hive import find_software_hive, open_hive
 
 __all__ = [
     "list_applications_apk",
@@ -17,6 +18,10 @@ __all__ = [
 
 L = logging.getLogger(__name__)
 
+_APK_RE = re.compile(rb"^([PV]):([^\n]*)", re.M)
+_DPKG_RE = re.compile(rb"^(Package|Status|Version):[ \t]*([^\n]*)", re.M)
+_PACMAN_RE = re.compile(rb"^%(NAME|VERSION)%\n([^\n]+)$", re.M)
+
 
 @log
 def list_applications_apk(path):
@@ -32,42 +37,34 @@ def list_applications_apk(path):
         List of packages. For example:
         [{'name': 'musl', 'version': '1.2.3-r0'}, ...]
     """
-    apk_db = None
+    apk_db = _find_db(path, ["lib/apk/db/installed"])
+    if apk_db is None:
+        L.debug("apk database not found")
+        return []
 
-    location = "lib/apk/db/installed"
+    return _parse_apk_db(apk_db)
 
-    db = os.path.join(path, location)
-    if os.path.exists(db):
-        apk_db = db
 
-    if apk_db is None:
-        for dir in subdirs(path):
-            new_path = os.path.join(path, dir)
-            db = os.path.join(new_path, location)
-            if os.path.exists(db):
-                apk_db = db
-                break
+@log
+@memoize
+def _parse_apk_db(db):
+    """Parse the installed packages from an apk database.
 
-    if apk_db is None:
-        L.debug("apk database not found")
-        return []
+    Args:
+        db (str): Path to the database, i.e. lib/apk/db/installed.
 
+    Returns:
+        List of packages.
+    """
     pkgs = []
-    with open(apk_db) as f:
-        name = version = ""
-        for line in f:
-            line = line.strip()
-            if not line:
-                if name and version:
-                    pkgs.append({
-                        "name": name,
-                        "version": version
-                    })
-                name = version = ""
-            elif line.startswith("P:"):
-                name = line[2:]
-            elif line.startswith("V:"):
-                version = line[2:]
+    for fields in _parse_records(db, _APK_RE):
+        name = fields.get(b"P", b"").strip()
+        version = fields.get(b"V", b"").strip()
+        if name and version:
+            pkgs.append({
+                "name": name.decode("utf-8", "replace"),
+                "version": version.decode("utf-8", "replace")
+            })
 
     return pkgs
 
@@ -86,61 +83,149 @@ def list_applications_dpkg(path):
         List of packages. For example:
         [{'name': 'adduser', 'version': '3.118'}, ...]
     """
-    dpkg_db = None
-
     locations = [
         "var/lib/dpkg/status",
         "lib/dpkg/status"  # separated /var partition
     ]
 
-    for location in locations:
-        db = os.path.join(path, location)
-        if os.path.exists(db):
-            dpkg_db = db
-            break
-
-    # Debian uses subvol=@rootfs for root filesystem for btrfs.
-    # Therefore, under Debian 11.* looks like this: /@rootfs/var/lib/dpkg
-    if dpkg_db is None:
-        for dir in subdirs(path):
-            new_path = os.path.join(path, dir)
-            for location in locations:
-                db = os.path.join(new_path, location)
-                if os.path.exists(db):
-                    dpkg_db = db
-                    break
-            else:
-                continue
-            break
-
+    dpkg_db = _find_db(path, locations)
     if dpkg_db is None:
         L.debug("dpkg database not found")
         return []
 
+    return _parse_dpkg_db(dpkg_db)
+
+
+@log
+@memoize
+def _parse_dpkg_db(db):
+    """Parse the installed packages from a dpkg status file.
+
+    Args:
+        db (str): Path to the status file.
+
+    Returns:
+        List of packages.
+    """
     pkgs = []
-    with open(dpkg_db) as f:
-        name = version = ""
-        installed = False
-        for line in f:
-            line = line.strip()
-            if not line:
-                if name and version and installed:
-                    pkgs.append({
-                        "name": name,
-                        "version": version
-                    })
-                name = version = ""
-                installed = False
-            elif line.startswith("Package:"):
-                name = line[9:]
-            elif line.startswith("Status:"):
-                installed = "installed" in line[8:].split()
-            elif line.startswith("Version:"):
-                version = line[9:]
+    for fields in _parse_records(db, _DPKG_RE):
+        name = fields.get(b"Package", b"").strip()
+        version = fields.get(b"Version", b"").strip()
+        installed = b"installed" in fields.get(b"Status", b"").split()
+        if name and version and installed:
+            pkgs.append({
+                "name": name.decode("utf-8", "replace"),
+                "version": version.decode("utf-8", "replace")
+            })
 
     return pkgs
 
 
+def _find_db(path, locations):
+    """Find a package database in a mounted filesystem.
+
+    The locations are first probed directly under the given path and then,
+    since the root filesystem may live in a btrfs subvolume, under each of
+    its subdirectories. For example, Debian uses subvol=@rootfs for btrfs,
+    so under Debian 11.* the dpkg database is at /@rootfs/var/lib/dpkg.
+
+    Args:
+        path (str): Path to the mounted filesystem.
+        locations (list): Candidate paths relative to the root filesystem.
+
+    Returns:
+        Path to the first existing location or None if nothing was found.
+    """
+    if db := _probe_db(path, locations):
+        return db
+
+    for entry in subdir_entries(path):
+        if db := _probe_db(entry.path, locations):
+            return db
+
+    return None
+
+
+def _probe_db(root, locations):
+    """Return the first existing location under root or None.
+
+    The directory is listed once, so that only locations whose top-level
+    component is actually present cost an additional stat call. This matters
+    on FUSE mounts where every syscall is comparatively expensive.
+    """
+    try:
+        names = set(os.listdir(root))
+    except OSError:
+        return None
+
+    for location in locations:
+        if location.split("/", 1)[0] not in names:
+            continue
+        db = os.path.join(root, location)
+        try:
+            os.stat(db)
+        except OSError:
+            continue
+        return db
+
+    return None
+
+
+def _split_package_version(pkg):
+    """Split a portage package directory name like `bison-3.8.2` at the last
+    hyphen followed by a digit into name and version.
+
+    See also:
+    https://projects.gentoo.org/pms/8/pms.html#x1-150003
+
+    Args:
+        pkg (str): Name of the package directory.
+
+    Returns:
+        Tuple of name and version or None if pkg does not contain a version.
+    """
+    i = len(pkg)
+    while (i := pkg.rfind("-", 0, i)) > 0:
+        if pkg[i + 1:i + 2].isdecimal():
+            return pkg[:i], pkg[i + 1:]
+
+    return None
+
+
+def _parse_records(path, pattern):
+    """Yield the fields of each record in a package database consisting of
+    blank line separated records, e.g. dpkg's status file.
+
+    The file is memory-mapped and scanned with a single regex pass instead of
+    decoding and testing it line by line.
+
+    Args:
+        path (str): Path to the package database.
+        pattern (re.Pattern): Compiled bytes pattern with two groups, the
+            field key and its value.
+
+    Returns:
+        Generator of dictionaries mapping keys to values, both as bytes.
+    """
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # the database is scanned once from start to end
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            fields = {}
+            end = mm.find(b"\n\n")
+            for m in pattern.finditer(mm):
+                if 0 <= end < m.start():
+                    yield fields
+                    fields = {}
+                    end = mm.find(b"\n\n", m.start())
+                fields[m.group(1)] = m.group(2)
+            if fields:
+                yield fields
+
+
 @log
 def list_applications_pacman(path):
     """Find all packages installed on a arch-based linux distribution.
@@ -155,53 +240,27 @@ def list_applications_pacman(path):
         List of packages. For example:
         [{'name': 'python', 'version': '3.10.6-1'}, ...]
     """
-    pacman_db = None
-
     locations = [
         "var/lib/pacman/local",
         "lib/pacman/local"  # separated /var partition
     ]
 
-    for location in locations:
-        db = os.path.join(path, location)
-        if os.path.exists(db):
-            pacman_db = db
-            break
-
-    # Just in case the system is using btrfs.
-    if pacman_db is None:
-        for dir in subdirs(path):
-            new_path = os.path.join(path, dir)
-            for location in locations:
-                db = os.path.join(new_path, location)
-                if os.path.exists(db):
-                    pacman_db = db
-                    break
-            else:
-                continue
-            break
-
+    pacman_db = _find_db(path, locations)
     if pacman_db is None:
         L.debug("pacman database not found")
         return []
 
     pkgs = []
-    for dir in subdirs(pacman_db):
-        desc = os.path.join(pacman_db, dir, "desc")
-        kv = {}
-        with open(desc) as f:
-            sections = re.split(r"\n(?=%[A-Z]+%)", f.read())
-            for section in sections:
-                section = section.strip()
-                if lines := section.split("\n"):
-                    k = lines[0].strip("%")
-                    n = len(lines)
-                    v = "" if n < 2 else lines[1:] if n > 2 else lines[1]
-                    kv[k] = v
-        if (name := kv.get("NAME")) and (version := kv.get("VERSION")):
+    for entry in subdir_entries(pacman_db):
+        desc = os.path.join(entry.path, "desc")
+        with open(desc, "rb") as f:
+            kv = dict(_PACMAN_RE.findall(f.read()))
+        name = kv.get(b"NAME", b"").strip()
+        version = kv.get(b"VERSION", b"").strip()
+        if name and version:
             pkgs.append({
-                "name": name,
-                "version": version
+                "name": name.decode("utf-8", "replace"),
+                "version": version.decode("utf-8", "replace")
             })
 
     return pkgs
@@ -221,44 +280,23 @@ def list_applications_portage(path):
         List of packages. For example:
         [{'name': 'sys-devel/bison', 'version': '3.8.2'}, ...]
     """
-    portage_db = None
-
     locations = [
         "var/db/pkg",
         "db/pkg"  # separated /var partition
     ]
 
-    for location in locations:
-        db = os.path.join(path, location)
-        if os.path.exists(db):
-            portage_db = db
-            break
-
-    # btrfs?
-    if portage_db is None:
-        for dir in subdirs(path):
-            new_path = os.path.join(path, dir)
-            for location in locations:
-                db = os.path.join(new_path, location)
-                if os.path.exists(db):
-                    portage_db = db
-                    break
-            else:
-                continue
-            break
-
+    portage_db = _find_db(path, locations)
     if portage_db is None:
         L.debug("portage database not found")
         return []
 
     pkgs = []
-    for cat in subdirs(portage_db):
-        for pkg in subdirs(os.path.join(portage_db, cat)):
-            # https://projects.gentoo.org/pms/8/pms.html#x1-150003
-            if m := re.match(r"^(.+)-(\d.*)$", pkg):
-                name, version = m.groups()
+    for cat in subdir_entries(portage_db):
+        for pkg in subdir_entries(cat.path):
+            if m := _split_package_version(pkg.name):
+                name, version = m
                 pkgs.append({
-                    "name": "/".join([cat, name]),
+                    "name": "/".join([cat.name, name]),
                     "version": version
                 })
 
@@ -276,30 +314,45 @@ def list_applications_rpm(path):
         List of packages. For example:
         [{'name': 'libgcc', 'version': '12.0.1'}, ...]
     """
-    rpm_db = None
-    for root, dirs, _ in os.walk(path):
-        if "usr" in dirs:
-            db = os.path.join(root, "usr/share/rpm")
-            if os.path.exists(db):
-                rpm_db = db
-                break
-            # https://fedoraproject.org/wiki/Changes/RelocateRPMToUsr
-            db = os.path.join(root, "usr/lib/sysimage/rpm")
-            if os.path.exists(db):
-                rpm_db = db
-                break
-        if "var" in dirs:
-            db = os.path.join(root, "var/lib/rpm")
-            if os.path.exists(db):
-                rpm_db = db
-                break
+    locations = [
+        "usr/share/rpm",
+        # https://fedoraproject.org/wiki/Changes/RelocateRPMToUsr
+        "usr/lib/sysimage/rpm",
+        "var/lib/rpm"
+    ]
 
+    # Fedora uses subvol=root for the root filesystem for btrfs, so the
+    # database is found at most one level below the mount point.
+    rpm_db = _find_db(path, locations)
     if rpm_db is None:
         L.debug("RPM database not found")
         return []
 
+    # sqlite, ndb and bdb backend respectively
+    for db in ("rpmdb.sqlite", "Packages.db", "Packages"):
+        if os.path.isfile(db := os.path.join(rpm_db, db)):
+            return _parse_rpm_db(db)
+
+    L.debug("no RPM database file found in %s", rpm_db)
+    return []
+
+
+@log
+@memoize
+def _parse_rpm_db(db):
+    """Parse the installed packages from a RPM database.
+
+    Args:
+        db (str): Path to the main file of the database, e.g. rpmdb.sqlite.
+
+    Returns:
+        List of packages.
+    """
+    # librpm is only initialized when actually inspecting a RPM-based system.
+    import rpm  # type: ignore
+
     rpm.setVerbosity(rpm.RPMLOG_CRIT)
-    rpm.addMacro("_dbpath", rpm_db)
+    rpm.addMacro("_dbpath", os.path.dirname(db))
     ts = rpm.TransactionSet()
 
     try:
@@ -308,12 +361,9 @@ def list_applications_rpm(path):
         L.error("failed to open RPM database: %r", e)
         return []
 
-    pkgs = []
-    for h in dbMatch:
-        pkgs.append({
-            "name": h["name"],
-            "version": h["version"]
-        })
+    # Numeric tags avoid resolving the tag name for every header.
+    name, version = rpm.RPMTAG_NAME, rpm.RPMTAG_VERSION
+    pkgs = [{"name": h[name], "version": h[version]} for h in dbMatch]
 
     rpm.delMacro("_dbpath")
 
@@ -331,56 +381,51 @@ def list_applications_windows(path):
         List of applications. For example:
         [{'name': 'Mozilla Firefox 43.0.1 (x86 de)', 'version': '43.0.1'}, ...]
     """
-    software = None
-
-    locations = [
-        "WINDOWS/system32/config/software",  # xp
-        "Windows/System32/config/SOFTWARE",  # others
-    ]
-
-    for location in locations:
-        software_path = os.path.join(path, location)
-        if os.path.isfile(software_path):
-            software = software_path
-            break
-
+    software = find_software_hive(path)
     if not software:
         L.debug("software hive not found in %s", path)
         return []
 
+    return _parse_software_hive(software)
+
+
+@log
+@memoize
+def _parse_software_hive(software):
+    """Parse the installed applications from a SOFTWARE registry hive.
+
+    Args:
+        software (str): Path to the hive file.
+
+    Returns:
+        List of applications.
+    """
     try:
-        registry = Registry.Registry(software)
+        registry = open_hive(software)
     except Exception as e:
         L.error("failed to open registry file %s: %r", software, e)
         return []
 
-    apps = []
+    hive_paths = [
+        # native applications
+        "Microsoft\\Windows\\CurrentVersion\\Uninstall",
+        # 32-bit applications running on WOW64 emulator
+        # see also: http://support.microsoft.com/kb/896459
+        "Wow6432Node\\Microsoft\\Windows\\CurrentVersion\\Uninstall"
+    ]
 
-    # native applications
-    hive_path = "Microsoft\\Windows\\CurrentVersion\\Uninstall"
-    try:
-        key = registry.open(hive_path)
-    except Exception as e:
-        L.error("%s not found in %s: %r", hive_path, software, e)
-        return apps
-    if apps_native := _list_applications_windows_from_key(key):
-        apps.extend(apps_native)
-
-    # 32-bit applications running on WOW64 emulator
-    # see also: http://support.microsoft.com/kb/896459
-    hive_path = "Wow6432Node\\Microsoft\\Windows\\CurrentVersion\\Uninstall"
-    try:
-        key = registry.open(hive_path)
-    except Exception as e:
-        L.error("%s not found in %s: %r", hive_path, software, e)
-        return apps
-    if apps_emulator := _list_applications_windows_from_key(key):
-        apps.extend(apps_emulator)
+    apps = []
+    for hive_path in hive_paths:
+        try:
+            key = registry.open(hive_path)
+        except Exception as e:
+            L.error("%s not found in %s: %r", hive_path, software, e)
+            break
+        apps.extend(_list_applications_windows_from_key(key))
 
     return apps
 
 
-@log
 def _list_applications_windows_from_key(key):
     """Parse applications from windows registry key.
 
@@ -391,23 +436,25 @@ def _list_applications_windows_from_key(key):
         key (Registry.Key): Registry key.
 
     Returns:
-        List of applications.
+        Generator of applications.
     """
-    apps = []
     for k in key.subkeys():
         # name = k.name()
         # name does not say much, so take the display name
         name = version = ""
+        # Key.value(name) would scan all values once per lookup, so match
+        # both names in a single pass and only decode the two values needed.
         for v in k.values():
-            if v.name() == "DisplayName":
+            value_name = v.name()
+            if value_name == "DisplayName":
                 name = v.value()
-            if v.name() == "DisplayVersion":
+            elif value_name == "DisplayVersion":
                 version = v.value()
+            if name and version:
+                break
         # ignore applications with no display name
         if name and version:
-            apps.append({
+            yield {
                 "name": name,
                 "version": version
-            })
-
-    return apps
+            }
@@ -1,15 +1,39 @@
 import os
 import logging
 import re
+import stat
 
 from glob import iglob
-from Registry import Registry  # type: ignore
-from . import log
+from . import log, subdir_entries
+from .cache import memoize
+from .hive import find_software_hive, open_hive
 
 __all__ = ["get_linux_os_info", "get_windows_os_info"]
 
 L = logging.getLogger(__name__)
 
+RELEASE_RE = re.compile(r"^(.*)\srelease\s(.*)$")
+GENTOO_RELEASE_RE = re.compile(r"^(Gentoo).*release\s(.*)$")
+
+# Keys of os-release used to determine name, version and package manager.
+OS_RELEASE_KEYS = frozenset(
+    ("NAME", "VERSION", "VERSION_ID", "BUILD_ID", "ID", "ID_LIKE")
+)
+
+# Maps os-release IDs (see ID and ID_LIKE) to the package manager in use.
+PACKAGE_MANAGERS = {
+    "alpine": "apk",
+    "debian": "dpkg",
+    "ubuntu": "dpkg",
+    "arch": "pacman",
+    "centos": "rpm",
+    "fedora": "rpm",
+    "rhel": "rpm",
+    "opensuse": "rpm",
+    "suse": "rpm",
+    "ol": "rpm"  # Oracle Linux 6.10
+}
+
 
 @log
 def get_linux_os_info(path):
@@ -27,19 +51,9 @@ def get_linux_os_info(path):
          'package_manager': 'rpm'}
     """
     release_files = {}
-    for root, dirs, _ in os.walk(path):
-        if "etc" in dirs:
-            for f in iglob(f"{root}/etc/*release"):
-                # Hack for immutable operating systems of Fedora.
-                if not os.path.exists(f):
-                    release_files.clear()
-                    break
-                if os.path.isfile(f):
-                    release_files[os.path.basename(f)] = f
-            else:
-                if release_files:
-                    break
-            continue
+    for etc in _find_etc_dirs(path):
+        if release_files := _find_release_files(etc):
+            break
 
     if not release_files:
         L.debug("no release file found")
@@ -54,7 +68,7 @@ def get_linux_os_info(path):
         # For consistency, use always centos-release first.
         with open(release_files["centos-release"]) as f:
             # AlmaLinux 8.* and Rocky Linux 8.* also have centos-release.
-            if m := re.match(r"^(.*)\srelease\s(.*)$", f.read()):
+            if m := RELEASE_RE.match(f.read()):
                 name, version = m.groups()
                 package_manager = "rpm"
     elif "gentoo-release" in release_files:
@@ -63,7 +77,7 @@ def get_linux_os_info(path):
         # gentoo-release is parsed before os-release at this point.
         L.debug("parsing %s", release_files["gentoo-release"])
         with open(release_files["gentoo-release"]) as f:
-            if m := re.match(r"^(Gentoo).*release\s(.*)$", f.read()):
+            if m := GENTOO_RELEASE_RE.match(f.read()):
                 name, version = m.groups()
                 package_manager = "portage"
     elif "os-release" in release_files:
@@ -71,10 +85,14 @@ def get_linux_os_info(path):
         with open(release_files["os-release"]) as f:
             kv = {}
             for line in f:
-                if not line or line.startswith("#") or "=" not in line:
+                # comments are skipped, since "#..." is never a known key
+                k, sep, v = line.partition("=")
+                if not sep or k not in OS_RELEASE_KEYS:
                     continue
-                k, v = line.split("=", 1)
                 kv[k] = v
+                # the remaining keys are only used as fallbacks for these
+                if "NAME" in kv and "VERSION" in kv and "ID_LIKE" in kv:
+                    break
             name = kv.get("NAME", "")
             version = kv.get("VERSION", kv.get("VERSION_ID", ""))
             # Arch-based distros have neither VERSION nor VERSION_ID.
@@ -84,21 +102,8 @@ def get_linux_os_info(path):
             id_like = kv.get("ID_LIKE", kv.get("ID", ""))
             id_like = id_like.strip().strip("'\"").split()
             for i in id_like:
-                if i == "alpine":
-                    package_manager = "apk"
-                elif i in ("debian", "ubuntu"):
-                    package_manager = "dpkg"
-                elif i == "arch":
-                    package_manager = "pacman"
-                elif i in ("centos", "fedora", "rhel"):
-                    package_manager = "rpm"
-                elif i in ("opensuse", "suse"):
-                    package_manager = "rpm"
-                elif i == "ol":  # Oracle Linux 6.10
-                    package_manager = "rpm"
-                else:
-                    continue
-                break
+                if package_manager := PACKAGE_MANAGERS.get(i, ""):
+                    break
     elif "system-release" in release_files:
         # RedHat (RHEL) provides the redhat-release file. However, it does not
         # seem to be reliable for determining which operating system it is.
@@ -106,7 +111,7 @@ def get_linux_os_info(path):
         # Oracle Linux 6.*, use system-release instead.
         L.debug("parsing %s", release_files["system-release"])
         with open(release_files["system-release"]) as f:
-            if m := re.match(r"^(.*)\srelease\s(.*)$", f.read()):
+            if m := RELEASE_RE.match(f.read()):
                 name, version = m.groups()
                 package_manager = "rpm"
 
@@ -123,6 +128,66 @@ def get_linux_os_info(path):
     }
 
 
+def _find_etc_dirs(path):
+    """Yield the candidate etc directories of a mounted filesystem, most
+    likely first, without walking the whole filesystem.
+
+    Args:
+        path (str): Path to the mounted filesystem.
+
+    Returns:
+        Generator of paths, which do not necessarily exist.
+    """
+    yield os.path.join(path, "etc")
+
+    # The root filesystem may live in a btrfs subvolume, e.g. /@rootfs/etc.
+    try:
+        roots = [path] + [entry.path for entry in subdir_entries(path)]
+    except OSError as e:
+        L.error("failed to list subdirectories of %s: %r", path, e)
+        return
+    for root in roots[1:]:
+        yield os.path.join(root, "etc")
+
+    # Immutable operating systems of Fedora keep the root filesystem in an
+    # ostree deployment.
+    # See also: https://ostreedev.github.io/ostree/deployment/
+    for root in roots:
+        yield from iglob(f"{root}/ostree/deploy/*/deploy/*/etc")
+
+
+def _find_release_files(etc):
+    """Find the release files, e.g. os-release, in an etc directory.
+
+    Args:
+        etc (str): Path to the etc directory.
+
+    Returns:
+        Dictionary mapping file names to paths. Empty if no release file was
+        found or if one of them is a dangling symlink.
+    """
+    release_files = {}
+    try:
+        with os.scandir(etc) as it:
+            for entry in it:
+                if entry.name.startswith(".") \
+                        or not entry.name.endswith("release"):
+                    continue
+                # A single stat, which follows symlinks, tells both whether
+                # the entry is a file and whether it is a dangling symlink.
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    # Hack for immutable operating systems of Fedora.
+                    return {}
+                if stat.S_ISREG(st.st_mode):
+                    release_files[entry.name] = entry.path
+    except OSError:
+        return {}
+
+    return release_files
+
+
 @log
 def get_windows_os_info(path):
     """Find and parse the software registry.
@@ -135,24 +200,26 @@ def get_windows_os_info(path):
         {'name': 'Microsoft Windows XP', 'version': '5.1',
          'package_manager': 'win'}
     """
-    software = None
+    software = find_software_hive(path)
+    if not software:
+        return {}
 
-    locations = [
-        "WINDOWS/system32/config/software",  # xp
-        "Windows/System32/config/SOFTWARE",  # others
-    ]
+    return _parse_software_hive(software)
 
-    for location in locations:
-        software_path = os.path.join(path, location)
-        if os.path.isfile(software_path):
-            software = software_path
-            break
 
-    if not software:
-        return {}
+@log
+@memoize
+def _parse_software_hive(software):
+    """Parse name and version of windows from a SOFTWARE registry hive.
+
+    Args:
+        software (str): Path to the hive file.
 
+    Returns:
+        Name and version of windows distribution as a dictionary.
+    """
     try:
-        registry = Registry.Registry(software)
+        registry = open_hive(software)
     except Exception as e:
         L.error("failed to open registry file %s: %r", software, e)
         return {}
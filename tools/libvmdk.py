@@ -1,19 +1,35 @@
-import io
+import atexit
 import logging
 import os
 import struct
 import tempfile
 
 from collections import namedtuple
-from subprocess import run
-from . import log, rm, rmdir
+from subprocess import PIPE, run
+from . import SPAWN_ENV, find_binary, log, mountpoints, rm, rmdir, shared
 
 __all__ = ["mount"]
 
 L = logging.getLogger(__name__)
 
+# See _extract_name_from_descriptor for the layout of the header.
+SPARSE_EXTENT_HEADER = struct.Struct("<IIIQQQQIQQQ?ccccHB")
+
+SparseExtentHeader = namedtuple(
+    "SparseExtentHeader",
+    "magic version flags capacity grain_size desc_offset desc_size "
+    "num_gtes_per_gt rgd_offset gd_offset overhead is_dirty "
+    "single_end_line_char non_end_line_char first_dbl_end_line_char "
+    "second_dbl_end_line_char compress_algorithm pad"
+)
+
+# Parent directory of the per-call directories for symlinks to renamed
+# images, shared by all calls of mount.
+_symlink_dir = None
+
 
 @log
+@shared
 def mount(path):
     """Mount a VMware Virtual Machine Disk (VMDK) file as a RAW image in the
     local filesystem with read-only support using `libvmdk`.
@@ -27,6 +43,9 @@ def mount(path):
     Returns:
         Path to the directory containing a single virtual file named `vmdk1`.
     """
+    if not (vmdkmount := find_binary("vmdkmount")):
+        return None
+
     # See also: https://github.com/libyal/libvmdk/issues/7
     # libvmdk currently can't mount VMDK files with type "monolithicSparse"
     # if they've been renamed. There is already a created issue that has been
@@ -37,38 +56,99 @@ def mount(path):
     name = _extract_name_from_descriptor(path)
     if renamed := (name and name != os.path.basename(path)):
         L.debug("%s has been renamed", path)
-        tempdir = tempfile.mkdtemp()
-        symlink = os.path.join(tempdir, name)
-        os.symlink(path, symlink)
+        if not (symlink := _create_symlink(path, name)):
+            return None
         L.debug("created symlink with original name: %s", symlink)
         path = symlink
 
-    mp = tempfile.mkdtemp()
-    cmd = ["vmdkmount", path, mp]
+    mp = mountpoints.acquire()
+    cmd = [vmdkmount, path, mp]
     try:
-        p = run(cmd, capture_output=True, check=False, text=True)
+        p = run(
+            cmd,
+            stdout=PIPE,
+            stderr=PIPE,
+            check=False,
+            env=SPAWN_ENV
+        )
     except Exception as e:
         L.error("failed to execute command %s: %r", cmd, e)
-        rmdir(mp)
+        mountpoints.release(mp)
         if renamed:
-            rm(symlink)
-            rmdir(tempdir)
+            _remove_symlink(symlink)
         return None
 
     if renamed:
-        rm(symlink)
-        rmdir(tempdir)
+        _remove_symlink(symlink)
 
     if os.path.ismount(mp):
         return mp
 
-    out, err = p.stdout.strip(), p.stderr.strip()
+    # only decode the output if it is actually logged
+    out = p.stdout.decode("utf-8", "replace").strip()
+    err = p.stderr.decode("utf-8", "replace").strip()
     L.error("retcode: %d, stdout: %s, stderr: %s", p.returncode, out, err)
-    rmdir(mp)
+    mountpoints.release(mp)
 
     return None
 
 
+def _get_symlink_dir():
+    """Return the parent directory for symlinks to renamed images. It is
+    created on first use and removed when the process exits.
+    """
+    global _symlink_dir
+    if _symlink_dir is None:
+        _symlink_dir = tempfile.mkdtemp()
+        atexit.register(rmdir, _symlink_dir)
+    return _symlink_dir
+
+
+def _create_symlink(path, name):
+    """Create a symlink with the original name of a renamed image.
+
+    The symlink is created in the shared directory. Only if a symlink with
+    the same name already exists, e.g. another image with the same original
+    name is being mounted, it is created in a private subdirectory instead.
+
+    Args:
+        path (str): Path to the VMDK file.
+        name (str): Original name of the VMDK file.
+
+    Returns:
+        Path to the symlink or None if it could not be created.
+    """
+    target = os.path.abspath(path)
+    symlink = os.path.join(_get_symlink_dir(), name)
+    try:
+        os.symlink(target, symlink)
+        return symlink
+    except FileExistsError:
+        pass
+    except OSError as e:
+        L.error("failed to create symlink %s: %r", symlink, e)
+        return None
+
+    try:
+        symlink = os.path.join(tempfile.mkdtemp(dir=_symlink_dir), name)
+        os.symlink(target, symlink)
+    except OSError as e:
+        L.error("failed to create symlink %s: %r", symlink, e)
+        if os.path.dirname(symlink) != _symlink_dir:
+            rmdir(os.path.dirname(symlink))
+        return None
+
+    return symlink
+
+
+def _remove_symlink(symlink):
+    """Remove a symlink to a renamed image along with its private directory
+    if any.
+    """
+    if rm(symlink) and os.path.dirname(symlink) != _symlink_dir:
+        rmdir(os.path.dirname(symlink))
+
+
 @log
 def _extract_name_from_descriptor(path):
     """
@@ -103,23 +183,11 @@ def _extract_name_from_descriptor(path):
     """
     with open(path, "rb") as fh:
         name = ""
-        if not (magic := fh.read(4)) or magic != b"KDMV":
+        data = fh.read(SPARSE_EXTENT_HEADER.size)
+        if len(data) < SPARSE_EXTENT_HEADER.size or data[:4] != b"KDMV":
             return None
 
-        fh.seek(-4, io.SEEK_CUR)
-
-        fmt = "<IIIQQQQIQQQ?ccccHB"
-        size = struct.calcsize(fmt)
-        data = fh.read(size)
-
-        Header = namedtuple(
-            "Header",
-            "magic version flags capacity grain_size desc_offset desc_size "
-            "num_gtes_per_gt rgd_offset gd_offset overhead is_dirty "
-            "single_end_line_char non_end_line_char first_dbl_end_line_char "
-            "second_dbl_end_line_char compress_algorithm pad"
-        )
-        header = Header._make(struct.unpack_from(fmt, data))
+        header = SparseExtentHeader._make(SPARSE_EXTENT_HEADER.unpack(data))
 
         # check if the descriptor is embedded
         if not (header.desc_offset > 0):
@@ -128,7 +196,9 @@ def _extract_name_from_descriptor(path):
         # extract disc descriptor file
         fh.seek(header.desc_offset * 512)
         data = fh.read(header.desc_size * 512)
-        descriptor = data.split(b"\x00", 1)[0].decode()
+        if (end := data.find(b"\x00")) >= 0:
+            data = data[:end]
+        descriptor = data.decode("utf-8", "replace")
 
         for line in descriptor.splitlines():
             if not (line := line.strip()) or line.startswith("#"):
@@ -1,9 +1,8 @@
 import logging
 import os
-import tempfile
 
-from subprocess import run
-from . import log, rmdir
+from subprocess import DEVNULL, PIPE, run
+from . import SPAWN_ENV, find_binary, log, mountpoints, shared
 
 __all__ = ["mount"]
 
@@ -11,6 +10,7 @@ L = logging.getLogger(__name__)
 
 
 @log
+@shared
 def mount(path, offset):
     """Mount a Linux Logical Volume Manager (LVM) volume system using
     `libvslvm`.
@@ -26,19 +26,30 @@ def mount(path, offset):
         Path to the directory containing volumes as a virtual file named
         `lvm1`, `lvm2`, etc.
     """
-    mp = tempfile.mkdtemp()
-    cmd = ["vslvmmount", "-o", str(offset), path, mp]
+    if not (vslvmmount := find_binary("vslvmmount")):
+        return ""
+
+    mp = mountpoints.acquire()
+    cmd = [vslvmmount, "-o", str(offset), path, mp]
     try:
-        p = run(cmd, capture_output=True, check=False, text=True)
+        p = run(
+            cmd,
+            stdout=DEVNULL,
+            stderr=PIPE,
+            check=False,
+            env=SPAWN_ENV
+        )
     except Exception as e:
         L.error("failed to execute command %s: %r", cmd, e)
-        rmdir(mp)
+        mountpoints.release(mp)
         return ""
 
-    out, err = p.stdout.strip(), p.stderr.strip()
     if p.returncode or not os.path.ismount(mp):
-        L.error("retcode: %d, stdout: %s, stderr: %s", p.returncode, out, err)
-        rmdir(mp)
+        # only decode the end of stderr if it is actually logged
+        err = p.stderr[-4096:].decode("utf-8", "replace").strip()
+        L.error("retcode: %d, stderr: %s", p.returncode, err)
+        mountpoints.release(mp)
         return ""
 
     return mp
+
@@ -1,17 +1,38 @@
 import logging
-import os
-import tempfile
 
-from subprocess import Popen, PIPE
-from time import sleep
-from . import log, rmdir
+from subprocess import DEVNULL, PIPE, Popen
+from . import (
+    SPAWN_ENV,
+    find_binary,
+    log,
+    log_failure,
+    mountpoints,
+    shared,
+    wait_for_mount
+)
 
 __all__ = ["mount"]
 
 L = logging.getLogger(__name__)
 
+# Additional mount options per filesystem type.
+_EXTRA_OPTS = {
+    # filesystem will be mounted without running log recovery.
+    # otherwise, the mount will fail.
+    # see also: https://man7.org/linux/man-pages/man5/xfs.5.html
+    "xfs": "opts=norecovery",
+    # allow mounting dirty ext3 and ext4 filesystems
+    # see also: https://man7.org/linux/man-pages/man5/ext3.5.html
+    # example error message that occurs e.g. when mounting Fedora 26:
+    # JBD2: recovery failed
+    # EXT4-fs (vda): error loading journal
+    "ext3": "opts=noload",
+    "ext4": "opts=noload"
+}
+
 
 @log
+@shared
 def mount(path, fs_type, part_nr=None):
     """Mount a RAW image file containing an ext2/ext3/ext4/xfs/btrfs/vfat/ntfs
     filesystem with read-only support using `lklfuse`.
@@ -24,43 +45,36 @@ def mount(path, fs_type, part_nr=None):
     Returns:
         Path to the mount point.
     """
-    mp = tempfile.mkdtemp()
+    if not (lklfuse := find_binary("lklfuse")):
+        return None
 
-    opts = f"ro,type={fs_type}"
+    mp = mountpoints.acquire()
+
+    opts = ["ro", f"type={fs_type}"]
     if part_nr is not None:
-        opts += f",part={part_nr}"
-    if fs_type == "xfs":
-        # filesystem will be mounted without running log recovery.
-        # otherwise, the mount will fail.
-        # see also: https://man7.org/linux/man-pages/man5/xfs.5.html
-        opts += ",opts=norecovery"
-    elif fs_type == "ext3" or fs_type == "ext4":
-        # allow mounting dirty ext3 and ext4 filesystems
-        # see also: https://man7.org/linux/man-pages/man5/ext3.5.html
-        # example error message that occurs e.g. when mounting Fedora 26:
-        # JBD2: recovery failed
-        # EXT4-fs (vda): error loading journal
-        opts += ",opts=noload"
-
-    cmd = ["lklfuse", path, mp, "-f", "-o", opts]
+        opts.append(f"part={part_nr}")
+    if extra := _EXTRA_OPTS.get(fs_type):
+        opts.append(extra)
+
+    cmd = [lklfuse, path, mp, "-f", "-o", ",".join(opts)]
 
     try:
-        p = Popen(cmd, stdout=PIPE, stderr=PIPE, text=True)
+        p = Popen(
+            cmd,
+            stdout=DEVNULL,
+            stderr=PIPE,
+            env=SPAWN_ENV
+        )
     except Exception as e:
         L.error("failed to execute command %s: %r", cmd, e)
-        rmdir(mp)
+        mountpoints.release(mp)
         return None
 
-    while p.poll() is None:
-        if os.path.ismount(mp):
-            return mp
-        sleep(1)
+    if wait_for_mount(mp, p):
+        return mp
 
-    ret = p.poll()
-    out, err = p.communicate()
-    out, err = out.strip(), err.strip()
-    L.error("retcode: %d, stdout: %s, stderr: %s", ret, out, err)
+    log_failure(p)
 
-    rmdir(mp)
+    mountpoints.release(mp)
 
     return None
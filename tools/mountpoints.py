@@ -0,0 +1,101 @@
+import atexit
+import logging
+import os
+import tempfile
+import threading
+
+from queue import Empty, SimpleQueue
+
+__all__ = ["acquire", "release"]
+
+L = logging.getLogger(__name__)
+
+# Maximum number of unused mount points kept for reuse.
+POOL_SIZE = 32
+
+_lock = threading.Lock()
+_parent = None
+_created = set()
+_free = SimpleQueue()
+
+
+def acquire():
+    """Get an empty directory to be used as mount point.
+
+    Unused mount points are reused, so that not every mount has to create and
+    remove a temporary directory. All mount points are created in a single
+    parent directory, which is removed along with them when the process exits.
+
+    Returns:
+        Path to the directory.
+
+    Raises:
+        OSError: If the directory could not be created.
+    """
+    try:
+        return _free.get_nowait()
+    except Empty:
+        pass
+
+    with _lock:
+        mp = tempfile.mkdtemp(dir=_get_parent())
+        _created.add(mp)
+
+    return mp
+
+
+def release(mp):
+    """Return a mount point acquired with acquire for reuse. If the pool is
+    full or the directory has not been acquired from it, the directory is
+    removed instead.
+
+    Args:
+        mp (str): Path to the directory, which must not be mounted anymore.
+
+    Returns:
+        True if the directory was released, False otherwise.
+    """
+    if os.path.ismount(mp):
+        L.error("failed to release %s: still mounted", mp)
+        return False
+
+    with _lock:
+        if mp in _created and _free.qsize() >= POOL_SIZE:
+            _created.discard(mp)
+        elif mp in _created:
+            _free.put(mp)
+            return True
+
+    return _remove(mp)
+
+
+def _get_parent():
+    """Return the parent directory of the mount points. It is created on
+    first use and removed when the process exits.
+    """
+    global _parent
+    if _parent is None:
+        _parent = tempfile.mkdtemp(prefix="vm_inspector_mounts_")
+        atexit.register(_cleanup)
+    return _parent
+
+
+def _cleanup():
+    """Remove the mount points and their parent directory."""
+    for mp in _created:
+        _remove(mp)
+
+    _remove(_parent)
+
+
+def _remove(path):
+    """Remove a directory. Like tools.rmdir, which can not be imported here,
+    since tools imports this module.
+    """
+    try:
+        os.rmdir(path)
+    except OSError as e:
+        L.error("failed to remove directory %s: %r", path, e)
+        return False
+
+    return True
@@ -1,10 +1,15 @@
 import logging
-import os
-import tempfile
 
-from subprocess import Popen, PIPE
-from time import sleep
-from . import log, rmdir
+from subprocess import DEVNULL, PIPE, Popen
+from . import (
+    SPAWN_ENV,
+    find_binary,
+    log,
+    log_failure,
+    mountpoints,
+    shared,
+    wait_for_mount
+)
 
 __all__ = ["mount"]
 
@@ -12,6 +17,7 @@ L = logging.getLogger(__name__)
 
 
 @log
+@shared
 def mount(path):
     """Mount a disk image file as a RAW image file in the local filesystem with
     read-only support using `qemu-nbd` + `nbdfuse`.
@@ -26,34 +32,39 @@ def mount(path):
     Returns:
         Path to the directory containing a single virtual file named `nbd`.
     """
-    mp = tempfile.mkdtemp()
+    nbdfuse = find_binary("nbdfuse")
+    qemu_nbd = find_binary("qemu-nbd")
+    if not nbdfuse or not qemu_nbd:
+        return ""
+
+    mp = mountpoints.acquire()
     cmd = [
-        "nbdfuse",
+        nbdfuse,
         "--readonly",
         mp,
         "--socket-activation",
-        "qemu-nbd",
+        qemu_nbd,
         "--read-only",
         path
     ]
 
     try:
-        p = Popen(cmd, stdout=PIPE, stderr=PIPE, text=True)
+        p = Popen(
+            cmd,
+            stdout=DEVNULL,
+            stderr=PIPE,
+            env=SPAWN_ENV
+        )
     except Exception as e:
         L.error("failed to execute command %s: %r", cmd, e)
-        rmdir(mp)
+        mountpoints.release(mp)
         return ""
 
-    while p.poll() is None:
-        if os.path.ismount(mp):
-            return mp
-        sleep(1)
+    if wait_for_mount(mp, p):
+        return mp
 
-    ret = p.poll()
-    out, err = p.communicate()
-    out, err = out.strip(), err.strip()
-    L.error("retcode: %d, stdout: %s, stderr: %s", ret, out, err)
+    log_failure(p)
 
-    rmdir(mp)
+    mountpoints.release(mp)
 
     return ""
@@ -1,13 +1,39 @@
+import copy
 import logging
+import os
 import parted  # type: ignore
+import struct
+import threading
 
+from collections import OrderedDict
 from . import log
 
-__all__ = ["list_partitions"]
+__all__ = ["iter_partitions", "list_partitions"]
 
 L = logging.getLogger(__name__)
 
-SUPPORTED_FS_TYPES = ["ext2", "ext3", "ext4", "xfs", "btrfs", "vfat", "ntfs"]
+SUPPORTED_FS_TYPES = frozenset(
+    ("ext2", "ext3", "ext4", "xfs", "btrfs", "vfat", "ntfs")
+)
+
+_LVM_FLAG = parted.PARTITION_LVM
+
+# Enough of the header to find the superblock of btrfs at 0x10040.
+_HEADER_SIZE = 0x10048
+
+# Feature flags of the ext superblock, which libparted uses to tell ext2,
+# ext3 and ext4 apart.
+# See also: https://www.kernel.org/doc/html/latest/filesystems/ext4/super.html
+_EXT3_COMPAT = 0x4  # has_journal
+_EXT4_INCOMPAT = 0x40 | 0x80 | 0x200  # extents, 64bit, flex_bg
+_EXT4_RO_COMPAT = 0x8 | 0x10 | 0x20  # huge_file, gdt_csum, dir_nlink
+
+# Results of list_partitions in least recently used order, keyed by the real
+# path, device, inode, modification time and size of the image file.
+_cache = OrderedDict()
+_CACHE_MAX = 128
+# libparted is not thread-safe, so the lock guards the cache and the parsing.
+_cache_lock = threading.Lock()
 
 
 @log
@@ -26,32 +52,129 @@ def list_partitions(path):
         [{'nr': 1, 'type': 'ext4', 'offset': 1048576, 'size': 1073741824},
          {'nr': 2, 'type': 'btrfs', 'offset': 1074790400, 'size': 20400046080}]
     """
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        L.error("failed to stat %s: %r", path, e)
+        return []
+
+    key = (
+        os.path.realpath(path),
+        st.st_dev,
+        st.st_ino,
+        st.st_mtime_ns,
+        st.st_size
+    )
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+        else:
+            if not (partitions := list(iter_partitions(path))):
+                return partitions
+            _cache[key] = partitions
+            if len(_cache) > _CACHE_MAX:
+                _cache.popitem(last=False)
+        # callers get a copy, so they cannot modify the cached result
+        return copy.deepcopy(_cache[key])
+
+
+def iter_partitions(path):
+    """Yield the partitions of a RAW image file like list_partitions, but
+    lazily and without caching. Thus, callers only interested in the first
+    partition, e.g. to determine the filesystem of a logical volume, can stop
+    before the remaining ones are read. Unlike list_partitions, it must not be
+    used from several threads at once.
+
+    Args:
+        path (str): Path to the RAW image file.
+
+    Returns:
+        Generator of partitions as dictionaries, see list_partitions.
+    """
+    # Images without a partition table, e.g. logical volumes, usually contain
+    # a single filesystem, which can be found in the header without libparted.
+    if fs := _probe_filesystem(path):
+        yield {"nr": 1, "type": fs[0], "offset": 0, "size": fs[1]}
+        return
+
     try:
         device = parted.getDevice(path)
     except Exception as e:
         L.error("failed to get device from %s: %r", path, e)
-        return []
+        return
 
     try:
         disk = parted.Disk(device)
     except Exception as e:
         L.error("failed to read disk from %s: %r", path, e)
-        return []
+        return
 
-    ret = []
+    sector_size = device.sectorSize
     for part in disk.partitions:
-        if part.fileSystem and part.fileSystem.type in SUPPORTED_FS_TYPES:
-            part_type = part.fileSystem.type
-        elif part.getFlag(parted.PARTITION_LVM):
+        fs = part.fileSystem
+        if fs and (fs_type := fs.type) in SUPPORTED_FS_TYPES:
+            part_type = fs_type
+        elif part.getFlag(_LVM_FLAG):
             part_type = "lvm"
         else:
             continue
 
-        ret.append({
+        geom = part.geometry
+        yield {
             "nr": part.number,
             "type": part_type,
-            "offset": part.geometry.start * device.sectorSize,  # in bytes
-            "size": part.geometry.length * device.sectorSize  # in bytes
-        })
+            "offset": geom.start * sector_size,  # in bytes
+            "size": geom.length * sector_size  # in bytes
+        }
+
+
+def _probe_filesystem(path):
+    """Detect an ext2/ext3/ext4, xfs or btrfs filesystem at the start of an
+    image file that has no partition table.
+
+    Images with a GPT or MBR, whose boot signature vfat and ntfs share, are
+    left to libparted.
+
+    Args:
+        path (str): Path to the RAW image file.
+
+    Returns:
+        Tuple of the filesystem type and the size of the image file in bytes
+        or None if no such filesystem was found.
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+            size = os.fstat(f.fileno()).st_size
+    except OSError as e:
+        L.error("failed to read header of %s: %r", path, e)
+        return None
+
+    if header[512:520] == b"EFI PART" or header[4096:4104] == b"EFI PART" \
+            or header[510:512] == b"\x55\xaa":
+        return None
+
+    if header[1080:1082] == b"\x53\xef":
+        compat, incompat, ro_compat = struct.unpack_from("<III", header, 1116)
+        if incompat & _EXT4_INCOMPAT or ro_compat & _EXT4_RO_COMPAT:
+            return "ext4", size
+        if compat & _EXT3_COMPAT:
+            return "ext3", size
+        return "ext2", size
+
+    if header[:4] == b"XFSB":
+        return "xfs", size
+
+    if header[0x10040:0x10048] == b"_BHRfS_M":
+        return "btrfs", size
+
+    return None
+
+
+def _cache_clear():
+    """Drop the cached results, e.g. after an image file has been rewritten."""
+    with _cache_lock:
+        _cache.clear()
+
 
-    return ret
+list_partitions.cache_clear = _cache_clear